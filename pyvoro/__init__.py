@@ -1,6 +1,15 @@
+import numpy as np
+
 from . import voroplusplus
+from .voroplusplus import Cell, Face, LazyVertices, VoronoiSession
+from .parallel import compute_voronoi_parallel
+
+__all__ = ['compute_voronoi', 'compute_2d_voronoi', 'compute_voronoi_parallel', 'Cell', 'Face',
+  'LazyVertices', 'VoronoiSession']
 
-def compute_voronoi(points, limits, dispersion, radii=[], periodic=[False]*3):
+def compute_voronoi(points, limits, dispersion, radii=[], periodic=[False]*3, init_mem=8,
+    output='cells', neighbors_only=False, return_type='dict', lazy_vertices=False,
+    validate=True):
   """
 Input arg formats:
   points = list of 3-vectors (lists or compatible class instances) of doubles,
@@ -13,6 +22,27 @@ Input arg formats:
     for radical (weighted) tessellation.
   periodic (optional) = 3-list of bools indicating x, y and z periodicity of 
     the system box.
+  init_mem (optional) = number of particles each voro++ block initially
+    reserves memory for (grown as needed.) Roughly the expected particles per
+    block; lower it for sparse systems to save memory.
+  output (optional) = 'cells' (default) for the list of cells described
+    below, or 'arrays' for the same tessellation as flat numpy arrays (see
+    the end of this docstring.)
+  neighbors_only (optional) = if True, only compute which cells are adjacent
+    to each cell, skipping the vertex and face geometry (see below.)
+  return_type (optional) = 'dict' (default) for cells and faces as dicts, as
+    below, or 'namedtuple' for Cell and Face namedtuples with the same fields,
+    which take less memory (around 15% less for the whole result.) Only
+    applies to the list of cells.
+  lazy_vertices (optional) = if True, each cell's 'vertices' is a LazyVertices
+    holding the packed coordinates, which builds the list of 3-vectors only
+    when first indexed or iterated (numpy.asarray gives a (V, 3) array without
+    it.) Saves most of the cost of the output when few cells' vertices are
+    looked at.
+  validate (optional) = if True (default), raise PointsOutsideLimitsError (a
+    ValueError and a VoronoiPlusPlusError) up front if any point is outside
+    the limits on a non-periodic axis (which voro++ would drop, failing the
+    whole tessellation only at the end) or not finite.
   
 Output format is a list of cells as follows:
   [ # list in same order as original points.
@@ -33,10 +63,40 @@ Output format is a list of cells as follows:
   NOTE: The class from items in input points list is reused for all 3-vector
   outputs. It must have a constructor which accepts a list of 3 python floats
   (python's list type does satisfy this requirement.)
+
+  With output='arrays', a dict of numpy arrays is returned instead, in a
+  compressed sparse row layout: each '*_offsets' array delimits slices of the
+  array it indexes, e.g. the vertices of cell i are
+  vertices[vert_offsets[i]:vert_offsets[i+1]].
+  {
+    'volumes' : (N,) cell volumes,
+    'vertices' : (V, 3) vertex positions of all cells, concatenated,
+    'vert_offsets' : (N+1,) cell -> rows of 'vertices',
+    'adjacency' : vertices adjacent to each vertex, concatenated,
+    'adj_offsets' : (V+1,) vertex -> slice of 'adjacency',
+    'face_vid' : vertices of each face in loop order, concatenated,
+    'face_offsets' : (F+1,) face -> slice of 'face_vid',
+    'face_adj_cell' : (F,) *cell* id across each face, negative if a wall,
+    'cell_face_offsets' : (N+1,) cell -> faces
+  }
+  Vertex ids in 'adjacency' and 'face_vid' are rows of 'vertices' (subtract
+  vert_offsets[i] for the per-cell ids used in the 'cells' format.) They and
+  the offsets are int64, as large tessellations have over 2^31 of them;
+  'face_adj_cell' is a C int array.
+
+  With neighbors_only=True, the result is a list holding, for each point, the
+  ids of the cells adjacent to its cell (negative for walls), in the same order
+  as its faces: [[34, -1, 12, ...], ...]. With output='arrays' as well, it is
+  {'neighbors' : ids for all cells, concatenated,
+   'neighbor_offsets' : (N+1,) int64 cell -> slice of 'neighbors'}.
+  This is all that is needed for Voronoi nearest-neighbour analysis, and is much
+  cheaper to compute and return than the full cells.
   """
-  return voroplusplus.compute_voronoi(points, limits, dispersion, radii, periodic)
+  return voroplusplus.compute_voronoi(points, limits, dispersion, radii, periodic, init_mem,
+    output, neighbors_only, return_type, lazy_vertices, validate)
 
-def compute_2d_voronoi(points, limits, dispersion, radii=[], periodic=[False]*2, z_height=0.5):
+def compute_2d_voronoi(points, limits, dispersion, radii=[], periodic=[False]*2, z_height=0.5,
+    init_mem=8, validate=True):
   """Input arg formats:
   points = list of 2-vectors (lists or compatible class instances) of doubles,
     being the coordinates of the points to Voronoi-tessellate.
@@ -50,6 +110,10 @@ def compute_2d_voronoi(points, limits, dispersion, radii=[], periodic=[False]*2,
     the system box.
   z_height = a suitable system-size dimension value (if this is particularly different to the
     other system lengths, voro++ will be very inefficient.)
+  init_mem (optional) = number of particles each voro++ block initially
+    reserves memory for (grown as needed.) Roughly the expected particles per
+    block; lower it for sparse systems to save memory.
+  validate (optional) = as for compute_voronoi.
   
 Output format is a list of cells as follows:
   [ # list in same order as original points.
@@ -67,12 +131,23 @@ Output format is a list of cells as follows:
     ... 
   ]"""
   vector_class = voroplusplus.get_constructor(points[0])
-  points = [list(p) for p in points]
-  points3d = [p[:] +[0.] for p in points]
-  limits3d = [l[:] for l in limits] + [[-z_height, +z_height]]
-  periodic = periodic + [False]
   
-  py_cells3d = voroplusplus.compute_voronoi(points3d, limits3d, dispersion, radii, periodic)
+  # the points are lifted onto the z = 0 plane in a single pass, and the 3D cells
+  # come back with their vertices as one (V, 3) array each, so no intermediate
+  # python vectors are built.
+  points3d = np.zeros((len(points), 3))
+  points3d[:, :2] = points
+  if validate:
+    voroplusplus.check_points(points3d[:, :2], limits, periodic)
+  limits3d = np.array([list(l) for l in limits] + [[-z_height, +z_height]], dtype=np.float64)
+  periodic = list(periodic) + [False]
+  if len(radii) != len(points):
+    radii = None
+  else:
+    radii = np.ascontiguousarray(radii, dtype=np.float64)
+  
+  py_cells3d = voroplusplus.compute_voronoi_buf(points3d, limits3d, dispersion, radii, periodic,
+    init_mem=init_mem)
   
   # we assume that each cell is a prism, and so the 2D solution for each cell contains
   # half of the vertices from the 3D solution. We verify this assumption by asserting
@@ -82,33 +157,48 @@ Output format is a list of cells as follows:
   py_cells = []
   depth = z_height * 2
   
-  for p3d in py_cells3d:
-    faces_to = [f['adjacent_cell'] for f in p3d['faces']]
-    assert(-5 in faces_to and -6 in faces_to)
-    vertices_to_keep = p3d['faces'][faces_to.index(-5)]['vertices']
-    
-    faces2d = []
+  for p3d, p in zip(py_cells3d, points):
+    # split the faces in a single pass: the -5 face gives the 2D vertices, the
+    # side faces become the 2D edges.
+    top_face = None
+    has_bottom = False
+    side_faces = []
     for f in p3d['faces']:
-      if f['adjacent_cell'] == -5 or f['adjacent_cell'] == -6:
-        continue
-      faces2d.append({
+      ac = f['adjacent_cell']
+      if ac == -5:
+        top_face = f
+      elif ac == -6:
+        has_bottom = True
+      else:
+        side_faces.append(f)
+    assert(top_face is not None and has_bottom)
+    vertices_to_keep = top_face['vertices']
+    n_keep = len(vertices_to_keep)
+    
+    # lookup from 3D vertex id to its index in the 2D cell; vertices on the -6
+    # face are dropped. faces are short, so a dict beats building an array
+    # per face.
+    keep_idx = {vid: i for i, vid in enumerate(vertices_to_keep)}
+    
+    faces2d = [{
         'adjacent_cell':f['adjacent_cell'],
-        'vertices' : [vertices_to_keep.index(vid) for vid in f['vertices'] if vid in vertices_to_keep]
-      })
+        'vertices' : [keep_idx[vid] for vid in f['vertices'] if vid in keep_idx]
+      } for f in side_faces]
+    
+    kept = p3d['vertices'][vertices_to_keep, :2].tolist()
     
     py_cells.append({
       'faces' : faces2d,
-      'original' : vector_class(p3d['original'][:-1]),
-      'vertices' : [vector_class(p3d['vertices'][v][:-1]) for v in vertices_to_keep],
+      'original' : vector_class(list(p)),
+      'vertices' : [vector_class(v) for v in kept],
       'volume' : p3d['volume'] / depth
     })
     
-    adj = [[len(vertices_to_keep)-1, 1]]
-    for i in range(1, len(vertices_to_keep)-1):
-      adj.append([i-1, i+1])
-    adj.append([len(vertices_to_keep)-2, 0])
-      
-    py_cells[-1]['adjacency'] = adj
+    # the 2D cell is a polygon, so each vertex is adjacent to its neighbours
+    # in loop order.
+    idx = np.arange(n_keep)
+    py_cells[-1]['adjacency'] = np.stack(
+      [(idx - 1) % n_keep, (idx + 1) % n_keep], axis=1).tolist()
   
   return py_cells
 
@@ -0,0 +1,248 @@
+#
+# parallel.py : process-parallel tessellation for pyvoro
+#
+# splits the box into slabs along its longest axis and tessellates each slab,
+# plus a halo of neighbouring particles, in its own worker process. this gives
+# parallelism when the extension was built without OpenMP.
+#
+# this extension to voro++ is released under the original modified BSD license
+# and constitutes an Extension to the original project.
+#
+# concurrent.futures and multiprocessing are imported where they are used, so
+# that they do not slow down `import pyvoro` for callers that never need them.
+#
+
+import os
+import warnings
+
+import numpy as np
+
+from . import voroplusplus
+
+
+def _wrap(x, lo, hi, periodic):
+  if periodic:
+    return lo + (x - lo) % (hi - lo)
+  return x
+
+
+def _offsets(counts):
+  offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+  np.cumsum(counts, out=offsets[1:])
+  return offsets
+
+
+def _cells_exact(arrays, points, x, axis, reach_lo, reach_hi, max_radius):
+  """
+Returns, for each cell of a compute_voronoi 'arrays' result, whether no particle
+outside the axis range [reach_lo, reach_hi] could cut it. A particle cuts a cell
+only if it is closer (in the power distance, for radical tessellations) to one
+of the cell's vertices than the cell's own particle is, so each vertex's ball
+must lie within the range.
+  """
+  starts = arrays['vert_offsets'][:-1]
+  cell = np.repeat(np.arange(len(points)), np.diff(arrays['vert_offsets']))
+  rel = arrays['vertices'] - points[cell]
+  reach = np.sqrt(np.einsum('ij,ij->i', rel, rel) + max_radius ** 2)
+  vx = rel[:, axis] + x[cell]
+  return ((np.minimum.reduceat(vx - reach, starts) >= reach_lo) &
+    (np.maximum.reduceat(vx + reach, starts) <= reach_hi))
+
+
+def _select_cells(arrays, keep):
+  """
+The cells of a compute_voronoi 'arrays' result where keep is True, in the same
+format (vertex ids renumbered to match.)
+  """
+  vert_counts = np.diff(arrays['vert_offsets'])
+  adj_counts = np.diff(arrays['adj_offsets'])
+  cell_face_counts = np.diff(arrays['cell_face_offsets'])
+  face_counts = np.diff(arrays['face_offsets'])
+  
+  keep_vert = np.repeat(keep, vert_counts)
+  keep_face = np.repeat(keep, cell_face_counts)
+  new_id = np.cumsum(keep_vert) - 1
+  return {
+    'volumes' : arrays['volumes'][keep],
+    'vertices' : arrays['vertices'][keep_vert],
+    'vert_offsets' : _offsets(vert_counts[keep]),
+    'adjacency' : new_id[arrays['adjacency'][np.repeat(keep_vert, adj_counts)]],
+    'adj_offsets' : _offsets(adj_counts[keep_vert]),
+    'face_vid' : new_id[arrays['face_vid'][np.repeat(keep_face, face_counts)]],
+    'face_offsets' : _offsets(face_counts[keep_face]),
+    'face_adj_cell' : arrays['face_adj_cell'][keep_face],
+    'cell_face_offsets' : _offsets(cell_face_counts[keep])
+  }
+
+
+def _slab_worker(shm_name, n, owned, lo, hi, axis, limits, dispersion, has_radii, periodic,
+    init_mem):
+  from multiprocessing import shared_memory
+
+  # attach to the shared points (and radii, in the fourth column); the view
+  # must be released before the segment can be closed.
+  shm = shared_memory.SharedMemory(name=shm_name)
+  try:
+    shared = np.ndarray((n, 4), dtype=np.float64, buffer=shm.buf)
+    data = shared.copy()
+    del shared
+  finally:
+    shm.close()
+
+  box_lo, box_hi = limits[axis]
+  length = box_hi - box_lo
+  x = _wrap(data[:, axis], box_lo, box_hi, periodic[axis])
+  max_radius = data[:, 3].max() if has_radii else 0.
+  pending = np.zeros(n, dtype=bool)
+  chunks = []
+
+  # start from a halo of two dispersions, and widen it until no particle left
+  # outside could change the slab's own cells. each pass only computes the
+  # cells that were not yet exact.
+  todo = owned
+  halo = 2 * dispersion
+  while len(todo):
+    if periodic[axis]:
+      rel = (x - lo) % length
+      near = (rel < hi - lo + halo) | (rel >= length - halo)
+      complete = hi - lo + 2 * halo >= length
+      reach_lo, reach_hi = lo - halo, hi + halo
+    else:
+      near = (x >= lo - halo) & (x < hi + halo)
+      complete = lo - halo <= box_lo and hi + halo >= box_hi
+      # there are no particles outside the box to worry about.
+      reach_lo = -np.inf if lo - halo <= box_lo else lo - halo
+      reach_hi = np.inf if hi + halo >= box_hi else hi + halo
+    pending[:] = False
+    pending[todo] = True
+    ids = np.concatenate([todo, np.flatnonzero(near & ~pending)])
+
+    # the slab shares the whole box's blocks, so their occupancy is low by
+    # design. only the cells to do (which come first) are computed; the rest
+    # of the halo only bounds them.
+    with warnings.catch_warnings():
+      warnings.simplefilter('ignore', RuntimeWarning)
+      arrays = voroplusplus.compute_voronoi_buf(np.ascontiguousarray(data[ids, :3]), limits,
+        dispersion, np.ascontiguousarray(data[ids, 3]) if has_radii else None, periodic,
+        init_mem=init_mem, output='arrays', n_cells=len(todo))
+
+    if complete:
+      exact = np.ones(len(todo), dtype=bool)
+    else:
+      exact = _cells_exact(arrays, data[todo, :3], x[todo], axis, reach_lo, reach_hi,
+        max_radius)
+    if exact.any():
+      done = _select_cells(arrays, exact)
+      # neighbour ids are mapped back to the caller's numbering.
+      walls = done['face_adj_cell'] < 0
+      done['face_adj_cell'] = np.where(walls, done['face_adj_cell'],
+        ids[np.where(walls, 0, done['face_adj_cell'])])
+      chunks.append((todo[exact], done))
+    todo = todo[~exact]
+    halo *= 2
+  return chunks
+
+
+def _arrays_to_cells(py_cells, cell_ids, arrays, points, vector_class):
+  # rebuilds compute_voronoi's cells from a worker's arrays, into py_cells.
+  volumes = arrays['volumes'].tolist()
+  vertices = arrays['vertices'].tolist()
+  vert_offsets = arrays['vert_offsets'].tolist()
+  adjacency = arrays['adjacency'].tolist()
+  adj_offsets = arrays['adj_offsets'].tolist()
+  face_vid = arrays['face_vid'].tolist()
+  face_offsets = arrays['face_offsets'].tolist()
+  face_adj_cell = arrays['face_adj_cell'].tolist()
+  cell_face_offsets = arrays['cell_face_offsets'].tolist()
+  for c, i in enumerate(cell_ids.tolist()):
+    base, end = vert_offsets[c], vert_offsets[c + 1]
+    py_cells[i] = {
+      'original' : points[i],
+      'volume' : volumes[c],
+      'vertices' : [vector_class(v) for v in vertices[base:end]],
+      'adjacency' : [[a - base for a in adjacency[adj_offsets[v]:adj_offsets[v + 1]]]
+        for v in range(base, end)],
+      'faces' : [{
+          'adjacent_cell' : face_adj_cell[f],
+          'vertices' : [v - base for v in face_vid[face_offsets[f]:face_offsets[f + 1]]]
+        } for f in range(cell_face_offsets[c], cell_face_offsets[c + 1])]
+    }
+
+
+def compute_voronoi_parallel(points, limits, dispersion, radii=[], periodic=[False]*3,
+    init_mem=8, n_jobs=-1, validate=True):
+  """
+Input arg formats:
+  points, limits, dispersion, radii, periodic, init_mem, validate = as for
+    compute_voronoi.
+  n_jobs (optional) = number of worker processes, -1 for one per CPU.
+
+Output format is as for compute_voronoi.
+
+The box is cut into n_jobs slabs along its longest axis, holding equal numbers
+of points. Each worker tessellates one slab together with a halo of the points
+near it, computing only the cells of the slab's own points. The halo starts at
+twice dispersion wide and is doubled, recomputing just the cells that a point
+outside it could still alter, until there are none. So the cells are the same
+as compute_voronoi's, though vertex numbering may differ.
+
+The points are shared with the workers through shared memory, and the cells
+come back as compute_voronoi's flat arrays. Each worker runs a single OpenMP
+thread, as the workers already occupy the cores. Worker processes are started
+afresh, so on platforms that spawn them (Windows, macOS) calls must be guarded
+by `if __name__ == '__main__':`.
+  """
+  if n_jobs == -1:
+    n_jobs = os.cpu_count() or 1
+  if n_jobs < 1:
+    raise ValueError("n_jobs must be -1 or at least 1.")
+
+  if validate:
+    voroplusplus.check_points(points, limits, periodic)
+
+  n = len(points)
+  n_jobs = min(n_jobs, n)
+  if n_jobs <= 1:
+    return voroplusplus.compute_voronoi(points, limits, dispersion, radii, periodic, init_mem,
+      validate=False)
+
+  from concurrent.futures import ProcessPoolExecutor
+  from multiprocessing import shared_memory
+
+  vector_class = voroplusplus.get_constructor(points[0])
+  limits = np.ascontiguousarray(limits, dtype=np.float64)
+  periodic = list(periodic)
+  has_radii = len(radii) == n
+  axis = int(np.argmax(limits[:, 1] - limits[:, 0]))
+  box_lo, box_hi = limits[axis]
+
+  shm = shared_memory.SharedMemory(create=True, size=n * 4 * 8)
+  try:
+    shared = np.ndarray((n, 4), dtype=np.float64, buffer=shm.buf)
+    shared[:, :3] = points
+    shared[:, 3] = radii if has_radii else 0.
+    x = _wrap(shared[:, axis].copy(), box_lo, box_hi, periodic[axis])
+    del shared
+
+    # equal numbers of particles per slab, rather than equal widths.
+    edges = np.quantile(x, np.linspace(0., 1., n_jobs + 1))
+    edges[0], edges[-1] = box_lo, box_hi
+    owner = np.clip(np.searchsorted(edges[1:-1], x, side='right'), 0, n_jobs - 1)
+    slabs = [np.flatnonzero(owner == s) for s in range(n_jobs)]
+
+    # one OpenMP thread per worker, or each would start a thread per core.
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=voroplusplus._set_num_threads,
+        initargs=(1,)) as executor:
+      futures = [executor.submit(_slab_worker, shm.name, n, slabs[s], edges[s], edges[s + 1],
+          axis, limits, dispersion, has_radii, periodic, init_mem)
+        for s in range(n_jobs)]
+      results = [future.result() for future in futures]
+  finally:
+    shm.close()
+    shm.unlink()
+
+  py_cells = [None] * n
+  for chunks in results:
+    for cell_ids, arrays in chunks:
+      _arrays_to_cells(py_cells, cell_ids, arrays, points, vector_class)
+  return py_cells
@@ -13,19 +13,41 @@
 #
 
 from libcpp.vector cimport vector
+from libc.string cimport memcpy
+from libc.stdint cimport int64_t
 from cython.operator cimport dereference as deref
+from cpython.bytes cimport PyBytes_FromStringAndSize
 
-cdef extern from "vpp.h":
+cdef extern from "vpp.h" nogil:
   void* container_poly_create(double ax_, double bx_, double ay_, double by_,
-    double az_, double bz_, int nx_, int ny_, int nz_, int px_, int py_, int pz_)
+    double az_, double bz_, int nx_, int ny_, int nz_, int px_, int py_, int pz_,
+    int init_mem_)
+  void container_poly_clear(void* container_poly_)
   void put_particle(void* container_poly_, int i_, double x_, double y_, double z_, double r_)
   void put_particles(void* container_poly_, int n_, double* x_, double* y_, double* z_, double* r_)
+  void put_particle_array(void* container_poly_, int n_, double* xyz_, double* r_)
   void** compute_voronoi_tesselation(void* container_poly_, int n_)
+  int compute_voronoi_neighbours(void* container_poly_, int n_, vector[int]& ids_,
+    vector[int64_t]& offsets_)
   double cell_get_volume(void* cell_)
   vector[double] cell_get_vertex_positions(void* cell_, double x_, double y_, double z_)
   void** cell_get_vertex_adjacency(void* cell_)
   void** cell_get_faces(void* cell_)
+  void set_num_threads(int n_)
+  void dispose_cells(void** vorocells, int n_)
   void dispose_all(void* container_poly_, void** vorocells, int n_)
+  
+  cdef cppclass tessellation_arrays:
+    vector[double] volumes
+    vector[double] vertices
+    vector[int64_t] vertex_offsets
+    vector[int64_t] adjacency
+    vector[int64_t] adjacency_offsets
+    vector[int64_t] face_vertices
+    vector[int64_t] face_offsets
+    vector[int] face_adjacent_cell
+    vector[int64_t] cell_face_offsets
+  void cells_get_arrays(void** vorocells, int n_, double* xyz_, tessellation_arrays& out_)
 
 
 cdef extern from "stdlib.h":
@@ -35,11 +57,149 @@ cdef extern from "stdlib.h":
 
 import sys
 import math
+import threading
+import warnings
+from collections import namedtuple
+from collections.abc import Sequence
+
+import numpy
 
 class VoronoiPlusPlusError(Exception):
   pass
 
 
+# raised for points voro++ cannot place. it was a VoronoiPlusPlusError before
+# the points were checked up front, so it is still one as well as a ValueError.
+class PointsOutsideLimitsError(VoronoiPlusPlusError, ValueError):
+  pass
+
+
+# compact alternatives to the cell and face dicts, see return_type.
+Cell = namedtuple('Cell', 'volume vertices adjacency faces original')
+Face = namedtuple('Face', 'vertices adjacent_cell')
+
+
+cdef class LazyVertices:
+  """
+A cell's vertex positions, kept as packed float64 x y z bytes until they are
+used. It behaves as the list of 3-vectors, which is built on first indexing,
+iteration or search and then kept (len() needs only the bytes); numpy.asarray
+gives a read-only (V, 3) float64 array over the bytes instead.
+  """
+  cdef readonly bytes data
+  cdef object vector_class
+  cdef list _vertices
+  
+  def __init__(self, bytes data, vector_class=list):
+    self.data = data
+    self.vector_class = vector_class
+  
+  def tolist(self):
+    if self._vertices is None:
+      coords = memoryview(self.data).cast('d').tolist()
+      self._vertices = [self.vector_class(coords[j:j + 3]) for j in range(0, len(coords), 3)]
+    return self._vertices
+  
+  def __len__(self):
+    return len(self.data) // (3 * sizeof(double))
+  
+  def __getitem__(self, i):
+    return self.tolist()[i]
+  
+  def __iter__(self):
+    return iter(self.tolist())
+  
+  def __reversed__(self):
+    return reversed(self.tolist())
+  
+  def __contains__(self, vertex):
+    return vertex in self.tolist()
+  
+  def index(self, vertex, *args):
+    return self.tolist().index(vertex, *args)
+  
+  def count(self, vertex):
+    return self.tolist().count(vertex)
+  
+  def __eq__(self, other):
+    if isinstance(other, LazyVertices):
+      other = (<LazyVertices>other).tolist()
+    return self.tolist() == other
+  
+  def __ne__(self, other):
+    return not self == other
+  
+  # unhashable, as a list is.
+  __hash__ = None
+  
+  def __array__(self, dtype=None, copy=None):
+    arr = numpy.frombuffer(self.data, dtype=numpy.float64).reshape(-1, 3)
+    if dtype is not None and numpy.dtype(dtype) != arr.dtype:
+      if copy is False:
+        raise ValueError("LazyVertices cannot be cast to %s without a copy." % numpy.dtype(dtype))
+      return arr.astype(dtype)
+    return arr.copy() if copy else arr
+  
+  def __reduce__(self):
+    return (LazyVertices, (self.data, self.vector_class))
+  
+  def __repr__(self):
+    return 'LazyVertices(%d vertices)' % len(self)
+
+Sequence.register(LazyVertices)
+
+
+cdef LazyVertices _lazy_vertices(vector[double]& v, vector_class):
+  cdef LazyVertices lazy = LazyVertices.__new__(LazyVertices)
+  lazy.data = PyBytes_FromStringAndSize(<char*>v.data(), sizeof(double) * v.size())
+  lazy.vector_class = list if vector_class is None else vector_class
+  return lazy
+
+
+cdef _double_array(vector[double]& v):
+  arr = numpy.empty(v.size(), dtype=numpy.float64)
+  cdef double[::1] buf = arr
+  if v.size() > 0:
+    memcpy(&buf[0], v.data(), sizeof(double) * v.size())
+  return arr
+
+
+cdef _int_array(vector[int]& v):
+  arr = numpy.empty(v.size(), dtype=numpy.intc)
+  cdef int[::1] buf = arr
+  if v.size() > 0:
+    memcpy(&buf[0], v.data(), sizeof(int) * v.size())
+  return arr
+
+
+cdef _int64_array(vector[int64_t]& v):
+  arr = numpy.empty(v.size(), dtype=numpy.int64)
+  cdef int64_t[::1] buf = arr
+  if v.size() > 0:
+    memcpy(&buf[0], v.data(), sizeof(int64_t) * v.size())
+  return arr
+
+
+cdef _cells_to_arrays(void** voronoi_cells, int n, double[:, ::1] points):
+  cdef tessellation_arrays out
+  with nogil:
+    if n > 0:
+      cells_get_arrays(voronoi_cells, n, &points[0, 0], out)
+    else:
+      cells_get_arrays(voronoi_cells, n, NULL, out)
+  return {
+    'volumes' : _double_array(out.volumes),
+    'vertices' : _double_array(out.vertices).reshape(-1, 3),
+    'vert_offsets' : _int64_array(out.vertex_offsets),
+    'adjacency' : _int64_array(out.adjacency),
+    'adj_offsets' : _int64_array(out.adjacency_offsets),
+    'face_vid' : _int64_array(out.face_vertices),
+    'face_offsets' : _int64_array(out.face_offsets),
+    'face_adj_cell' : _int_array(out.face_adjacent_cell),
+    'cell_face_offsets' : _int64_array(out.cell_face_offsets)
+  }
+
+
 def get_constructor(obj):
   """
 Input arg format:
@@ -56,7 +216,9 @@ Input arg format:
   return typ
 
 
-def compute_voronoi(points, limits, dispersion, radii=[], periodic=[False]*3):
+def compute_voronoi(points, limits, dispersion, radii=[], periodic=[False]*3, init_mem=8,
+    output='cells', neighbors_only=False, return_type='dict', lazy_vertices=False,
+    validate=True):
   """
 Input arg formats:
   points = list of 3-vectors (lists or compatible class instances) of doubles,
@@ -69,6 +231,27 @@ Input arg formats:
     for radical (weighted) tessellation.
   periodic (optional) = 3-list of bools indicating x, y and z periodicity of 
     the system box.
+  init_mem (optional) = number of particles each voro++ block initially
+    reserves memory for (grown as needed.) Roughly the expected particles per
+    block; lower it for sparse systems to save memory.
+  output (optional) = 'cells' (default) for the list of cells described
+    below, or 'arrays' for the same tessellation as flat numpy arrays (see
+    the end of this docstring.)
+  neighbors_only (optional) = if True, only compute which cells are adjacent
+    to each cell, skipping the vertex and face geometry (see below.)
+  return_type (optional) = 'dict' (default) for cells and faces as dicts, as
+    below, or 'namedtuple' for Cell and Face namedtuples with the same fields,
+    which take less memory (around 15% less for the whole result.) Only
+    applies to the list of cells.
+  lazy_vertices (optional) = if True, each cell's 'vertices' is a LazyVertices
+    holding the packed coordinates, which builds the list of 3-vectors only
+    when first indexed or iterated (numpy.asarray gives a (V, 3) array without
+    it.) Saves most of the cost of the output when few cells' vertices are
+    looked at.
+  validate (optional) = if True (default), raise PointsOutsideLimitsError (a
+    ValueError and a VoronoiPlusPlusError) up front if any point is outside
+    the limits on a non-periodic axis (which voro++ would drop, failing the
+    whole tessellation only at the end) or not finite.
   
 Output format is a list of cells as follows:
   [ # list in same order as original points.
@@ -89,82 +272,270 @@ Output format is a list of cells as follows:
   NOTE: The class from items in input points list is reused for all 3-vector
   outputs. It must have a constructor which accepts a list of 3 python floats
   (python's list type does satisfy this requirement.)
+
+  With output='arrays', a dict of numpy arrays is returned instead, in a
+  compressed sparse row layout: each '*_offsets' array delimits slices of the
+  array it indexes, e.g. the vertices of cell i are
+  vertices[vert_offsets[i]:vert_offsets[i+1]].
+  {
+    'volumes' : (N,) cell volumes,
+    'vertices' : (V, 3) vertex positions of all cells, concatenated,
+    'vert_offsets' : (N+1,) cell -> rows of 'vertices',
+    'adjacency' : vertices adjacent to each vertex, concatenated,
+    'adj_offsets' : (V+1,) vertex -> slice of 'adjacency',
+    'face_vid' : vertices of each face in loop order, concatenated,
+    'face_offsets' : (F+1,) face -> slice of 'face_vid',
+    'face_adj_cell' : (F,) *cell* id across each face, negative if a wall,
+    'cell_face_offsets' : (N+1,) cell -> faces
+  }
+  Vertex ids in 'adjacency' and 'face_vid' are rows of 'vertices' (subtract
+  vert_offsets[i] for the per-cell ids used in the 'cells' format.) They and
+  the offsets are int64, as large tessellations have over 2^31 of them;
+  'face_adj_cell' is a C int array.
+
+  With neighbors_only=True, the result is a list holding, for each point, the
+  ids of the cells adjacent to its cell (negative for walls), in the same order
+  as its faces: [[34, -1, 12, ...], ...]. With output='arrays' as well, it is
+  {'neighbors' : ids for all cells, concatenated,
+   'neighbor_offsets' : (N+1,) int64 cell -> slice of 'neighbors'}.
+  This is all that is needed for Voronoi nearest-neighbour analysis, and is much
+  cheaper to compute and return than the full cells.
   """
-  cdef int n = len(points), i, j
-  cdef double *xs, *ys, *zs, *rs
-  cdef void** voronoi_cells
-  
   vector_class = get_constructor(points[0])
+  
+  # if no radii provided, we still run the radical routine, but with all the same small radius.
+  if len(radii) != len(points):
+    radii = None
+  else:
+    radii = numpy.ascontiguousarray(radii, dtype=numpy.float64)
+  
+  points_buf = numpy.ascontiguousarray(points, dtype=numpy.float64)
+  limits_buf = numpy.ascontiguousarray(limits, dtype=numpy.float64)
+  if validate:
+    check_points(points_buf, limits_buf, periodic)
+  
+  return compute_voronoi_buf(
+    points_buf,
+    limits_buf,
+    dispersion, radii, periodic, points, vector_class, init_mem, output, neighbors_only,
+    return_type, lazy_vertices
+  )
 
-  periodic = [1 if p else 0 for p in periodic]
+
+def compute_voronoi_buf(double[:, ::1] points, double[:, ::1] limits, double dispersion,
+    double[::1] radii=None, periodic=[False]*3, originals=None, vector_class=None,
+    int init_mem=8, output='cells', neighbors_only=False, return_type='dict',
+    lazy_vertices=False, n_cells=None):
+  """
+Input arg formats:
+  points = (N, 3) C-contiguous float64 array of the coordinates of the points
+    to voronoi-tesselate.
+  limits = (3, 2) C-contiguous float64 array of the start and end sizes of the
+    box the points are in.
+  dispersion, periodic, init_mem, output, neighbors_only, return_type,
+    lazy_vertices = as for compute_voronoi.
+  radii (optional) = (N,) float64 array of sphere radii, or None for an
+    unweighted tessellation.
+  originals (optional) = sequence to take each cell's 'original' entry from;
+    by default the rows of points.
+  vector_class (optional) = constructor for 3-vector outputs, called with a list
+    of 3 python floats. By default each cell's 'vertices' is returned as a
+    single (V, 3) float64 array (or a LazyVertices of lists, with
+    lazy_vertices.)
+  n_cells (optional) = compute and return only the cells of the first n_cells
+    points; the remaining points only bound them. By default all N.
+  
+Output format is as for compute_voronoi. The coordinates are copied from the
+buffers in one pass without converting each one to a python object.
+  """
+  _check_options(output, return_type)
+  
+  cdef void* container = _create_container(limits, dispersion, periodic, init_mem,
+    points.shape[0])
+  try:
+    return _tessellate(container, points, dispersion, radii, originals, vector_class, output,
+      neighbors_only, return_type, lazy_vertices, n_cells)
+  finally:
+    # finally, tidy up.
+    dispose_all(container, NULL, 0)
+
+
+def check_points(points, limits, periodic=[False]*3):
+  """
+Input arg formats:
+  points = (N, D) array-like of point coordinates.
+  limits = (D, 2) array-like of the start and end sizes of the box.
+  periodic (optional) = D-list of bools; points may lie anywhere along a
+    periodic axis, as voro++ wraps them into the box.
+
+Raises PointsOutsideLimitsError if any point is not finite, or lies outside
+[start, end) on a non-periodic axis. voro++ cannot place such points, and would
+only report the missing cells (as a VoronoiPlusPlusError) after computing all
+the others; the error is both a ValueError and a VoronoiPlusPlusError.
+  """
+  points = numpy.asarray(points, dtype=numpy.float64)
+  limits = numpy.asarray(limits, dtype=numpy.float64)
+  bounded = ~numpy.asarray(periodic, dtype=bool)
+  
+  # voro++ blocks are half-open, so a point on the end of the box is outside it.
+  bad = ~numpy.isfinite(points).all(axis=1)
+  bad |= ((points[:, bounded] < limits[bounded, 0]) |
+    (points[:, bounded] >= limits[bounded, 1])).any(axis=1)
+  if bad.any():
+    raise PointsOutsideLimitsError("%d points are outside the limits or not finite, the "
+      "first at index %d." % (int(bad.sum()), int(numpy.argmax(bad))))
+
+
+cdef _check_options(output, return_type):
+  if output not in ('cells', 'arrays'):
+    raise ValueError("output must be 'cells' or 'arrays'.")
+  
+  if return_type not in ('dict', 'namedtuple'):
+    raise ValueError("return_type must be 'dict' or 'namedtuple'.")
+
+
+cdef _blocks(double[:, ::1] limits, double dispersion):
+  if limits.shape[0] != 3 or limits.shape[1] != 2:
+    raise ValueError("limits must have shape (3, 2).")
+  
+  if dispersion <= 0:
+    raise ValueError("dispersion must be positive.")
   
   # we must make sure we have at least one block, or voro++ will segfault when
   # we look for cells.
   
-  blocks = [
-    max([1, int(math.floor((limits[0][1] - limits[0][0]) / dispersion))]),
-    max([1, int(math.floor((limits[1][1] - limits[1][0]) / dispersion))]),
-    max([1, int(math.floor((limits[2][1] - limits[2][0]) / dispersion))])
+  return [
+    max([1, int(math.floor((limits[0, 1] - limits[0, 0]) / dispersion))]),
+    max([1, int(math.floor((limits[1, 1] - limits[1, 0]) / dispersion))]),
+    max([1, int(math.floor((limits[2, 1] - limits[2, 0]) / dispersion))])
   ]
+
+
+cdef void* _create_container(double[:, ::1] limits, double dispersion, periodic,
+    int init_mem, int n) except NULL:
+  blocks = _blocks(limits, dispersion)
+  periodic = [1 if p else 0 for p in periodic]
   
-  # if no radii provided, we still run the radical routine, but with all the same small radius.
-  if len(radii) != len(points):
-    radii = [dispersion / 10.] * len(points)
+  # voro++ performs best with around 5 particles per block; far from that,
+  # either the cell searches scan too many particles or memory is spent on
+  # empty blocks. only worth mentioning for large systems.
+  per_block = float(n) / (blocks[0] * blocks[1] * blocks[2])
+  if n >= 1000 and not (0.5 <= per_block <= 50.):
+    warnings.warn("dispersion gives %.3g particles per voro++ block (around 5 is "
+      "ideal); consider a different dispersion." % per_block, RuntimeWarning)
+  
+  if init_mem < 1:
+    raise ValueError("init_mem must be at least 1.")
   
   # build the container object
-  cdef void* container = container_poly_create(
-    <double>limits[0][0],
-    <double>limits[0][1],
-    <double>limits[1][0],
-    <double>limits[1][1],
-    <double>limits[2][0],
-    <double>limits[2][1],
+  return container_poly_create(
+    limits[0, 0],
+    limits[0, 1],
+    limits[1, 0],
+    limits[1, 1],
+    limits[2, 0],
+    limits[2, 1],
     <int>blocks[0],
     <int>blocks[1],
     <int>blocks[2],
     <int>periodic[0],
     <int>periodic[1],
-    <int>periodic[2]
+    <int>periodic[2],
+    init_mem
   )
+
+
+cdef _tessellate(void* container, double[:, ::1] points, double dispersion, double[::1] radii,
+    originals, vector_class, output, neighbors_only, return_type, lazy_vertices,
+    n_cells=None):
+  # fills the (empty) container with the points and extracts the cells of the
+  # first n_cells of them; the container itself is left to the caller.
+  cdef int n = points.shape[0]
+  cdef int m = n if n_cells is None else n_cells
+  cdef void** voronoi_cells
+  cdef vector[int] neighbour_ids
+  cdef vector[int64_t] neighbour_offsets
+  cdef int neighbours_found
   
-  xs = <double*>malloc(sizeof(double) * n)
-  ys = <double*>malloc(sizeof(double) * n)
-  zs = <double*>malloc(sizeof(double) * n)
-  rs = <double*>malloc(sizeof(double) * n)
+  if points.shape[1] != 3:
+    raise ValueError("points must have shape (N, 3).")
   
-  # initialise particle positions:
-  for i from 0 <= i < n:
-    xs[i] = <double>points[i][0]
-    ys[i] = <double>points[i][1]
-    zs[i] = <double>points[i][2]
-    rs[i] = <double>radii[i]
-    
-  # and add them to the container:
-  put_particles(container, n, xs, ys, zs, rs)
-    
-  # now compute the tessellation:
-  voronoi_cells = compute_voronoi_tesselation(container, n)
+  if radii is None:
+    radii = numpy.full(n, dispersion / 10.)
+  elif radii.shape[0] != n:
+    raise ValueError("radii must have one entry per point.")
+  
+  if not 0 <= m <= n:
+    raise ValueError("n_cells must be between 0 and the number of points.")
+  
+  as_tuples = return_type == 'namedtuple'
+  
+  if originals is None:
+    originals = numpy.asarray(points)
+  
+  # add the particles to the container and compute the tessellation; this part
+  # is pure C++ (and multi-threaded if built with OpenMP), so we release the GIL.
+  with nogil:
+    if n > 0:
+      put_particle_array(container, n, &points[0, 0], &radii[0])
+  
+  if neighbors_only:
+    with nogil:
+      neighbours_found = compute_voronoi_neighbours(container, m, neighbour_ids,
+        neighbour_offsets)
+    if not neighbours_found:
+      raise VoronoiPlusPlusError("number of cells found was not equal to the number of particles.")
+    ids = _int_array(neighbour_ids)
+    offsets = _int64_array(neighbour_offsets)
+    if output == 'arrays':
+      return {'neighbors' : ids, 'neighbor_offsets' : offsets}
+    ids = ids.tolist()
+    offsets = offsets.tolist()
+    return [ids[offsets[i]:offsets[i + 1]] for i in range(m)]
+  
+  with nogil:
+    voronoi_cells = compute_voronoi_tesselation(container, m)
   
   if voronoi_cells == NULL:
-    dispose_all(container, NULL, 0)
     raise VoronoiPlusPlusError("number of cells found was not equal to the number of particles.")
-    
+  
+  try:
+    if output == 'arrays':
+      return _cells_to_arrays(voronoi_cells, m, points)
+    return _cells_to_python(voronoi_cells, m, points, originals, vector_class, as_tuples,
+      lazy_vertices)
+  finally:
+    dispose_cells(voronoi_cells, m)
+
+
+cdef _cells_to_python(void** voronoi_cells, int n, double[:, ::1] points, originals,
+    vector_class, bint as_tuples, bint lazy_vertices):
   # extract the Voronoi cells into python objects:
-  py_cells = [{'original':p} for p in points]
+  cdef int i, j, k, nv
+  cdef double[:, ::1] vertex_buf
+  py_cells = []
   cdef vector[double] vertex_positions
   cdef void** lists = NULL
   cdef vector[int]* vptr = NULL
   for i from 0 <= i < n:
-    py_cells[i]['volume'] = float(cell_get_volume(voronoi_cells[i]))
-    vertex_positions = cell_get_vertex_positions(voronoi_cells[i], xs[i], ys[i], zs[i])
-    cell_vertices = []
-    for j from 0 <= j < vertex_positions.size() / 3:
-      cell_vertices.append(vector_class([
-        float(vertex_positions[3 * j]),
-        float(vertex_positions[3 * j + 1]),
-        float(vertex_positions[3 * j + 2])
-      ]))
-    py_cells[i]['vertices'] = cell_vertices
+    volume = float(cell_get_volume(voronoi_cells[i]))
+    vertex_positions = cell_get_vertex_positions(voronoi_cells[i],
+      points[i, 0], points[i, 1], points[i, 2])
+    nv = vertex_positions.size() // 3
+    if lazy_vertices:
+      cell_vertices = _lazy_vertices(vertex_positions, vector_class)
+    elif vector_class is None:
+      cell_vertices = numpy.empty((nv, 3), dtype=numpy.float64)
+      vertex_buf = cell_vertices
+      memcpy(&vertex_buf[0, 0], vertex_positions.data(), sizeof(double) * 3 * nv)
+    else:
+      cell_vertices = []
+      for j from 0 <= j < nv:
+        cell_vertices.append(vector_class([
+          float(vertex_positions[3 * j]),
+          float(vertex_positions[3 * j + 1]),
+          float(vertex_positions[3 * j + 2])
+        ]))
     
     lists = cell_get_vertex_adjacency(voronoi_cells[i])
     adjacency = []
@@ -178,7 +549,6 @@ Output format is a list of cells as follows:
       adjacency.append(py_vertex_adjacency)
       j += 1
     free(lists)
-    py_cells[i]['adjacency'] = adjacency
     
     lists = cell_get_faces(voronoi_cells[i])
     faces = []
@@ -188,20 +558,102 @@ Output format is a list of cells as follows:
       vptr = <vector[int]*>lists[j]
       for k from 0 <= k < vptr.size() - 1:
         face_vertices.append(int(deref(vptr)[k]))
-      faces.append({
-        'adjacent_cell' : int(deref(vptr)[vptr.size() - 1]),
-        'vertices' : face_vertices
-      })
+      adjacent_cell = int(deref(vptr)[vptr.size() - 1])
+      if as_tuples:
+        faces.append(Face(face_vertices, adjacent_cell))
+      else:
+        faces.append({
+          'adjacent_cell' : adjacent_cell,
+          'vertices' : face_vertices
+        })
       del vptr
       j += 1
     free(lists)
-    py_cells[i]['faces'] = faces
     
-  # finally, tidy up.
-  dispose_all(container, voronoi_cells, n)
-  free(xs)
-  free(ys)
-  free(zs)
-  free(rs)
+    if as_tuples:
+      py_cells.append(Cell(volume, cell_vertices, adjacency, faces, originals[i]))
+    else:
+      py_cells.append({
+        'original' : originals[i],
+        'volume' : volume,
+        'vertices' : cell_vertices,
+        'adjacency' : adjacency,
+        'faces' : faces
+      })
+  
   return py_cells
 
+
+def _set_num_threads(int n):
+  """
+Sets the number of OpenMP threads later calls in this process may use (no-op
+for a build without OpenMP.)
+  """
+  set_num_threads(n)
+
+
+cdef class VoronoiSession:
+  """
+Repeated tessellations of one box, e.g. the frames of a simulation trajectory.
+
+Input arg formats:
+  limits, dispersion, periodic = as for compute_voronoi; fixed for the
+    session.
+  n_estimate (optional) = expected number of points per call. Sizes the voro++
+    blocks' initial memory (unless init_mem is given) and is used for the
+    particles-per-block warning.
+  init_mem (optional) = as for compute_voronoi.
+
+The voro++ container is built once and emptied before each compute() call,
+rather than created and freed every time. Its blocks keep the memory they grew
+to, so after the first call no reallocation is needed while the number of
+points stays similar. A lock serialises compute() calls on the same session;
+use one session per thread to tessellate concurrently.
+  """
+  cdef void* container
+  cdef double _dispersion
+  cdef object _limits, _periodic, _lock
+  
+  def __cinit__(self, limits, dispersion, periodic=[False]*3, n_estimate=0, init_mem=None):
+    self.container = NULL
+    self._dispersion = dispersion
+    self._lock = threading.Lock()
+    
+    limits = numpy.ascontiguousarray(limits, dtype=numpy.float64)
+    self._limits = limits
+    self._periodic = list(periodic)
+    if init_mem is None:
+      blocks = _blocks(limits, self._dispersion)
+      init_mem = n_estimate // (blocks[0] * blocks[1] * blocks[2]) + 1 if n_estimate > 0 else 8
+    self.container = _create_container(limits, self._dispersion, periodic, init_mem,
+      n_estimate)
+  
+  def __dealloc__(self):
+    if self.container != NULL:
+      dispose_all(self.container, NULL, 0)
+  
+  def compute(self, points, radii=[], output='cells', neighbors_only=False,
+      return_type='dict', lazy_vertices=False, validate=True):
+    """
+Input arg formats:
+  points, radii, output, neighbors_only, return_type, lazy_vertices,
+    validate = as for compute_voronoi. Points must lie in the session's box.
+
+Output format is as for compute_voronoi.
+    """
+    _check_options(output, return_type)
+    vector_class = get_constructor(points[0])
+    
+    if radii is None or len(radii) != len(points):
+      radii = None
+    else:
+      radii = numpy.ascontiguousarray(radii, dtype=numpy.float64)
+    
+    points_buf = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    if validate:
+      check_points(points_buf, self._limits, self._periodic)
+    
+    with self._lock:
+      container_poly_clear(self.container)
+      return _tessellate(self.container, points_buf, self._dispersion, radii, points,
+        vector_class, output, neighbors_only, return_type, lazy_vertices)
@@ -14,15 +14,26 @@
 
 #include "vpp.h"
 #include "../src/voro++.hh"
+/* the voro_compute templates are defined here, rather than compiled on their
+ * own, so that they can be instantiated for container_poly_view below. */
+#include "../src/v_compute.cc"
 #include <stdio.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 using namespace voro;
 using namespace std;
 
 void* container_poly_create(double ax_, double bx_, double ay_, double by_,
-  double az_, double bz_, int nx_, int ny_, int nz_, int px_, int py_, int pz_) {
+  double az_, double bz_, int nx_, int ny_, int nz_, int px_, int py_, int pz_,
+  int init_mem_) {
   
   return (void*)new container_poly(ax_, bx_, ay_, by_, az_, bz_, nx_, ny_, nz_, (bool)px_,
-      (bool)py_, (bool)pz_, 3);
+      (bool)py_, (bool)pz_, init_mem_);
+}
+
+void container_poly_clear(void* container_poly_) {
+  ((container_poly*)container_poly_)->clear();
 }
 
 void put_particle(void* container_poly_, int i_, double x_, double y_, double z_, double r_) {
@@ -38,40 +49,170 @@ void put_particles(void* container_poly_, int n_, double* x_, double* y_, double
   }
 }
 
+void put_particle_array(void* container_poly_, int n_, double* xyz_, double* r_) {
+  container_poly* c = (container_poly*)container_poly_;
+  int i;
+  for (i = 0; i < n_; i++) {
+    c->put(i, xyz_[3 * i], xyz_[3 * i + 1], xyz_[3 * i + 2], r_[i]);
+  }
+}
+
+/* the data extracted from a computed voronoicell_neighbor. Only this is kept
+ * per particle, so the cell itself (and its large vertex/edge buffers) can be
+ * reused for every particle a thread computes.
+ */
+struct cell_record {
+  double volume;
+  vector<double> vertices;  /* relative to the particle, 3 per vertex. */
+  vector<int> orders;       /* number of edges from each vertex. */
+  vector<int> edges;        /* concatenated edge lists, orders[i] per vertex. */
+  vector<int> face_vertices;  /* voro++ format: order, then vertex ids. */
+  vector<int> neighbours;   /* adjacent cell id of each face. */
+};
+
+static cell_record* cell_record_create(voronoicell_neighbor& cell) {
+  cell_record* rec = new cell_record();
+  int i, j;
+  
+  rec->volume = cell.volume();
+  cell.vertices(rec->vertices);
+  rec->orders.resize(cell.p);
+  for (i = 0; i < cell.p; i++) {
+    rec->orders[i] = cell.nu[i];
+    for (j = 0; j < cell.nu[i]; j++) {
+      rec->edges.push_back(cell.ed[i][j]);
+    }
+  }
+  cell.neighbors(rec->neighbours);
+  cell.face_vertices(rec->face_vertices);
+  
+  return rec;
+}
+
+/* a thread's handle on a shared, populated container. voro++ keeps per-cell
+ * scratch state next to the particles: the search mask and queue in the
+ * container's voro_compute, and the current particle's radius in radius_poly.
+ * a view has its own copies of just those, and reads the container's particle
+ * arrays, so any number of views can compute cells at once without copying
+ * the particles.
+ */
+class container_poly_view : public radius_poly {
+  public:
+    container_poly& con;
+    const double boxx, boxy, boxz, xsp, ysp, zsp;
+    const int ps;
+    int** id;
+    double** p;
+    int* co;
+    const unsigned int* wl;
+    double* mrad;
+    
+    container_poly_view(container_poly& con_) :
+      con(con_), boxx(con_.boxx), boxy(con_.boxy), boxz(con_.boxz), xsp(con_.xsp),
+      ysp(con_.ysp), zsp(con_.zsp), ps(con_.ps), id(con_.id), p(con_.p), co(con_.co),
+      wl(con_.wl), mrad(con_.mrad),
+      vc(*this, con_.xperiodic ? 2 * con_.nx + 1 : con_.nx,
+        con_.yperiodic ? 2 * con_.ny + 1 : con_.ny,
+        con_.zperiodic ? 2 * con_.nz + 1 : con_.nz) {
+      ppr = con_.p;
+      max_radius = con_.max_radius;
+    }
+    
+    template<class v_cell>
+    inline bool compute_cell(v_cell& c, int ijk, int q) {
+      int k = ijk / con.nxy, ijkt = ijk - con.nxy * k, j = ijkt / con.nx, i = ijkt - j * con.nx;
+      return vc.compute_cell(c, ijk, q, i, j, k);
+    }
+    
+    /* the geometry queries voro_compute makes of its container. */
+    template<class v_cell>
+    inline bool initialize_voronoicell(v_cell& c, int ijk, int q, int ci, int cj, int ck,
+        int& i, int& j, int& k, double& x, double& y, double& z, int& disp) {
+      return con.initialize_voronoicell(c, ijk, q, ci, cj, ck, i, j, k, x, y, z, disp);
+    }
+    inline void initialize_search(int ci, int cj, int ck, int ijk, int& i, int& j, int& k,
+        int& disp) {
+      con.initialize_search(ci, cj, ck, ijk, i, j, k, disp);
+    }
+    inline void frac_pos(double x, double y, double z, double ci, double cj, double ck,
+        double& fx, double& fy, double& fz) {
+      con.frac_pos(x, y, z, ci, cj, ck, fx, fy, fz);
+    }
+    inline int region_index(int ci, int cj, int ck, int ei, int ej, int ek, double& qx,
+        double& qy, double& qz, int& disp) {
+      return con.region_index(ci, cj, ck, ei, ej, ek, qx, qy, qz, disp);
+    }
+    
+  private:
+    voro_compute<container_poly_view> vc;
+    friend class voro_compute<container_poly_view>;
+};
+
+/* computes the cell of every particle in the container with an id below n_,
+ * passing each one to store(id, cell); the other particles only bound them.
+ * returns the number of cells found.
+ * every cell is independent, so the blocks are shared out between threads;
+ * each particle id is passed to store by exactly one thread.
+ */
+template<class c_store>
+static int compute_all_cells(container_poly* con, int n_, c_store& store) {
+  int found = 0;
+  
+  #pragma omp parallel reduction(+:found)
+  {
+    container_poly_view view(*con);
+    voronoicell_neighbor cell;
+    int ijk, q;
+    
+    #pragma omp for schedule(dynamic)
+    for (ijk = 0; ijk < con->nxyz; ijk++) {
+      for (q = 0; q < con->co[ijk]; q++) {
+        // compute_cell reinitialises the cell in place, so its memory is
+        // reused; store must copy out whatever it needs.
+        if (con->id[ijk][q] < n_ && view.compute_cell(cell, ijk, q)) {
+          store(con->id[ijk][q], cell);
+          found++;
+        }
+      }
+    }
+  }
+  
+  return found;
+}
+
+struct record_store {
+  void** vorocells;
+  void operator()(int i, voronoicell_neighbor& cell) {
+    vorocells[i] = (void*)cell_record_create(cell);
+  }
+};
+
+struct neighbour_store {
+  vector<vector<int> >* neighbours;
+  vector<char>* computed;
+  void operator()(int i, voronoicell_neighbor& cell) {
+    cell.neighbors((*neighbours)[i]);
+    (*computed)[i] = 1;
+  }
+};
+
 void** compute_voronoi_tesselation(void* container_poly_, int n_) {
   container_poly* con = (container_poly*)container_poly_;
-  int found = 0;
+  int found;
   int i;
-  double x, y, z, r;
-  c_loop_all* cla = new c_loop_all(*(con));
-  voronoicell_neighbor cell;
-  voronoicell_neighbor* cellptr = NULL;
   
   void** vorocells = (void**)malloc(sizeof(void*) * n_);
   
   for (i = 0; i < n_; i++) vorocells[i] = NULL;
   
-  if(cla->start()) do if (con->compute_cell(cell, *(cla))) {
-
-    // Get the position and ID information for the particle
-    // currently being considered by the loop.
-    cla->pos(i, x, y, z, r);
-    
-    // Store the resulting cell instance at the appropriate index on vorocells.
-    cellptr = new voronoicell_neighbor();
-    *(cellptr) = cell;
-    vorocells[i] = (void*)cellptr;
-    found++;
-    
-  } while (cla->inc());
-  
-  delete cla;
+  record_store store = {vorocells};
+  found = compute_all_cells(con, n_, store);
   
   if (found != n_) {
     printf("missing cells: ");
     for (i = 0; i < n_; i++) {
       if (vorocells[i] != NULL) {
-        delete (voronoicell_neighbor*)vorocells[i];
+        delete (cell_record*)vorocells[i];
       } else {
         printf("%i ", i);
       }
@@ -84,10 +225,37 @@ void** compute_voronoi_tesselation(void* container_poly_, int n_) {
   return vorocells;
 }
 
+int compute_voronoi_neighbours(void* container_poly_, int n_, vector<int>& ids_,
+  vector<int64_t>& offsets_) {
+  container_poly* con = (container_poly*)container_poly_;
+  vector<vector<int> > neighbours(n_);
+  vector<char> computed(n_, 0);
+  int i;
+  size_t j;
+  
+  neighbour_store store = {&neighbours, &computed};
+  if (compute_all_cells(con, n_, store) != n_) {
+    printf("missing cells: ");
+    for (i = 0; i < n_; i++) {
+      if (!computed[i]) printf("%i ", i);
+    }
+    printf("\n");
+    return 0;
+  }
+  
+  offsets_.push_back(0);
+  for (i = 0; i < n_; i++) {
+    for (j = 0; j < neighbours[i].size(); j++) ids_.push_back(neighbours[i][j]);
+    offsets_.push_back(ids_.size());
+  }
+  
+  return 1;
+}
+
 /* access methods for retrieving voronoi cell instance data. */
 double cell_get_volume(void* cell_) {
-  voronoicell_neighbor* cell = (voronoicell_neighbor*)cell_;
-  return cell->volume();
+  cell_record* cell = (cell_record*)cell_;
+  return cell->volume;
 }
 
 /* input: (x_, y_, z_) the position of the original input point.
@@ -95,27 +263,31 @@ double cell_get_volume(void* cell_) {
  * vector of doubles, coord j of vertex i at ret[i*3 + j]
  */
 vector<double> cell_get_vertex_positions(void* cell_, double x_, double y_, double z_) {
-  voronoicell_neighbor* cell = (voronoicell_neighbor*)cell_;
-  vector<double> positions;
+  cell_record* cell = (cell_record*)cell_;
+  vector<double> positions(cell->vertices.size());
+  size_t i;
   
-  cell->vertices(x_, y_, z_, positions);
+  for (i = 0; i < positions.size(); i += 3) {
+    positions[i] = x_ + cell->vertices[i];
+    positions[i + 1] = y_ + cell->vertices[i + 1];
+    positions[i + 2] = z_ + cell->vertices[i + 2];
+  }
   
   return positions;
 }
 
 /* NULL-termed list (i) of vector<int>s (j) of vertices adjacent to i. */
 void** cell_get_vertex_adjacency(void* cell_) {
-  voronoicell_neighbor* cell = (voronoicell_neighbor*)cell_;
-  int i, j, v_i_order, num_vertices = cell->p;
+  cell_record* cell = (cell_record*)cell_;
+  int i, j, k = 0, num_vertices = cell->orders.size();
   
   void** adjacency = (void**)malloc(sizeof(void*) * (num_vertices + 1));
   vector<int>* vertex_adjacency;
   
   for (i = 0; i < num_vertices; i++) {
-    v_i_order = cell->nu[i];
     vertex_adjacency = new vector<int>();
-    for (j = 0; j < v_i_order; j++) {
-      vertex_adjacency->push_back(cell->ed[i][j]);
+    for (j = 0; j < cell->orders[i]; j++) {
+      vertex_adjacency->push_back(cell->edges[k++]);
     }
     adjacency[i] = (void*)vertex_adjacency;
   }
@@ -129,24 +301,19 @@ void** cell_get_vertex_adjacency(void* cell_) {
  * [2 0 5 7 3 -1 249] for loop 2,0,5,7,3 leading to cell 249.
  */
 void** cell_get_faces(void* cell_) {
-  voronoicell_neighbor* cell = (voronoicell_neighbor*)cell_;
-  int i, j, f_i_order, num_faces = cell->number_of_faces();
+  cell_record* cell = (cell_record*)cell_;
+  int i, j, k = 0, f_i_order, num_faces = cell->neighbours.size();
   
   void** faces = (void**)malloc(sizeof(void*) * (num_faces + 1));
-  vector<int> vertices;
-  vector<int> neighbours;
   vector<int>* output_list = NULL;
   
-  cell->neighbors(neighbours);
-  cell->face_vertices(vertices);
   for (i = 0; i < num_faces; i++) {
-    f_i_order = vertices[0];
+    f_i_order = cell->face_vertices[k++];
     output_list = new vector<int>();
-    for (j = 1; j <= f_i_order; j++) {
-      output_list->push_back(vertices[j]);
+    for (j = 0; j < f_i_order; j++) {
+      output_list->push_back(cell->face_vertices[k++]);
     }
-    output_list->push_back(neighbours[i]);
-    vertices.erase(vertices.begin(),vertices.begin()+f_i_order+1);
+    output_list->push_back(cell->neighbours[i]);
     faces[i] = (void*)output_list;
   }
   faces[num_faces] = NULL;
@@ -154,17 +321,67 @@ void** cell_get_faces(void* cell_) {
   return faces;
 }
 
-
-void dispose_all(void* container_poly_, void** vorocells, int n_) {
-  delete (container_poly*)container_poly_;
+void cells_get_arrays(void** vorocells, int n_, double* xyz_, tessellation_arrays& out_) {
+  cell_record* cell;
+  int i, j, f, k, f_i_order;
+  int64_t base;
+  size_t v;
+  
+  out_.vertex_offsets.push_back(0);
+  out_.adjacency_offsets.push_back(0);
+  out_.face_offsets.push_back(0);
+  out_.cell_face_offsets.push_back(0);
   
+  for (i = 0; i < n_; i++) {
+    cell = (cell_record*)vorocells[i];
+    base = out_.vertex_offsets.back();
+    
+    out_.volumes.push_back(cell->volume);
+    for (v = 0; v < cell->vertices.size(); v++) {
+      out_.vertices.push_back(xyz_[3 * i + v % 3] + cell->vertices[v]);
+    }
+    out_.vertex_offsets.push_back(base + cell->orders.size());
+    
+    k = 0;
+    for (j = 0; j < (int)cell->orders.size(); j++) {
+      for (f = 0; f < cell->orders[j]; f++) {
+        out_.adjacency.push_back(base + cell->edges[k++]);
+      }
+      out_.adjacency_offsets.push_back(out_.adjacency.size());
+    }
+    
+    k = 0;
+    for (f = 0; f < (int)cell->neighbours.size(); f++) {
+      f_i_order = cell->face_vertices[k++];
+      for (j = 0; j < f_i_order; j++) {
+        out_.face_vertices.push_back(base + cell->face_vertices[k++]);
+      }
+      out_.face_offsets.push_back(out_.face_vertices.size());
+      out_.face_adjacent_cell.push_back(cell->neighbours[f]);
+    }
+    out_.cell_face_offsets.push_back(out_.face_adjacent_cell.size());
+  }
+}
+
+void set_num_threads(int n_) {
+#ifdef _OPENMP
+  omp_set_num_threads(n_);
+#endif
+}
+
+void dispose_cells(void** vorocells, int n_) {
   if (vorocells == NULL) return;
   
   int i;
   for (i = 0; i < n_; i++) {
-    delete (voronoicell_neighbor*)vorocells[i];
+    delete (cell_record*)vorocells[i];
   }
   
   free(vorocells);
 }
 
+void dispose_all(void* container_poly_, void** vorocells, int n_) {
+  delete (container_poly*)container_poly_;
+  dispose_cells(vorocells, n_);
+}
+
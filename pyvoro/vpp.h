@@ -18,16 +18,37 @@
 #define __VPP_H__ 1
 
 #include <vector>
+#include <stdint.h>
 
 void* container_poly_create(double ax_, double bx_, double ay_, double by_,
-  double az_, double bz_, int nx_, int ny_, int nz_, int px_, int py_, int pz_);
+  double az_, double bz_, int nx_, int ny_, int nz_, int px_, int py_, int pz_,
+  int init_mem_);
+
+/* empties the container, keeping its blocks' memory for the next particles. */
+void container_poly_clear(void* container_poly_);
 
 void put_particle(void* container_poly_, int i_, double x_, double y_, double z_, double r_);
 
 void put_particles(void* container_poly_, int n_, double* x_, double* y_, double* z_, double* r_);
 
+/* xyz_ holds the coordinates packed as x0 y0 z0 x1 y1 z1 ... */
+void put_particle_array(void* container_poly_, int n_, double* xyz_, double* r_);
+
+/* computes the cells of the particles with ids 0 to n_-1. any further particles
+ * in the container only bound those cells. returns NULL if a cell could not be
+ * computed.
+ */
 void** compute_voronoi_tesselation(void* container_poly_, int n_);
 
+/* computes only the ids of the cells adjacent to each particle's cell, in face
+ * order (negative for walls), skipping the vertex and face data. those of
+ * particle i are ids_[offsets_[i]] up to ids_[offsets_[i+1]]. as above, only
+ * particles 0 to n_-1 are computed.
+ * returns 0 if a cell could not be computed.
+ */
+int compute_voronoi_neighbours(void* container_poly_, int n_, std::vector<int>& ids_,
+  std::vector<int64_t>& offsets_);
+
 /* access methods for retrieving voronoi cell instance data. */
 double cell_get_volume(void* cell_);
 
@@ -46,6 +67,31 @@ void** cell_get_vertex_adjacency(void* cell_);
  */
 void** cell_get_faces(void* cell_);
 
+/* the whole tessellation as flat arrays, offsets delimiting each cell's
+ * (or face's, or vertex's) slice of the array after it. Vertex ids in
+ * adjacency and face_vertices index into the concatenated vertices. offsets
+ * and vertex ids are 64-bit, as a tessellation of tens of millions of cells
+ * has more than 2^31 of them.
+ */
+struct tessellation_arrays {
+  std::vector<double> volumes;
+  std::vector<double> vertices;        /* 3 per vertex, global coordinates. */
+  std::vector<int64_t> vertex_offsets;    /* n+1, cell i -> vertices. */
+  std::vector<int64_t> adjacency;
+  std::vector<int64_t> adjacency_offsets; /* one per vertex, +1. */
+  std::vector<int64_t> face_vertices;
+  std::vector<int64_t> face_offsets;      /* one per face, +1. */
+  std::vector<int> face_adjacent_cell;    /* one per face. */
+  std::vector<int64_t> cell_face_offsets; /* n+1, cell i -> faces. */
+};
+
+/* input: xyz_ the original input points, packed as for put_particle_array. */
+void cells_get_arrays(void** vorocells, int n_, double* xyz_, tessellation_arrays& out_);
+
+void set_num_threads(int n_);
+
+void dispose_cells(void** vorocells, int n_);
+
 void dispose_all(void* container_poly_, void** vorocells, int n_);
 
 #endif
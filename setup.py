@@ -8,18 +8,90 @@
 # contact: <joe.jordan@imperial.ac.uk> or <tehwalrus@h2j9k.org>
 #
 
-from distutils.core import setup, Extension
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import CompileError, LinkError
 from Cython.Build import cythonize
+import os
 import os.path
+import shutil
+import sys
+import tempfile
 
+# v_compute.cc is not listed: pyvoro/vpp.cpp includes it, to instantiate its
+# templates for its own per-thread container views.
 source_files = ['cell.cc', 'common.cc', 'container.cc', 'unitcell.cc', 
-                'v_compute.cc', 'c_loops.cc', 'v_base.cc', 'wall.cc',
+                'c_loops.cc', 'v_base.cc', 'wall.cc',
                 'pre_container.cc', 'container_prd.cc']
 source_files = [os.path.join('src', fname) for fname in source_files]
 
+# voro++'s cell cutting is short floating point loops, which benefit from
+# aggressive optimisation and cross-file inlining. its tolerance-based plane
+# tests are sensitive to rounding, though: with -ffast-math (/fp:fast) or fused
+# multiply-adds (which -march=native would otherwise enable) cells come out as
+# the whole box, so both stay off. -march=native (/arch:AVX2) ties the build to
+# the building machine's CPU; set PYVORO_PORTABLE=1 when building binaries for
+# distribution.
+portable = os.environ.get('PYVORO_PORTABLE', '0') not in ('', '0')
+
+if sys.platform == 'win32':
+    compile_args = ['/O2', '/GL']
+    link_args = ['/LTCG']
+    if not portable:
+        compile_args.append('/arch:AVX2')
+else:
+    compile_args = ['-O3', '-funroll-loops', '-fno-math-errno', '-ffp-contract=off',
+                    '-flto', '-std=c++14']
+    link_args = ['-flto']
+    if not portable:
+        compile_args.append('-march=native')
+
+# cells are computed in parallel with OpenMP where the compiler supports it;
+# Apple's clang does not ship OpenMP, so the build there stays serial. other
+# compilers (e.g. clang without libomp) are probed at build time, see below.
+if sys.platform == 'win32':
+    compile_args.append('/openmp')
+elif sys.platform != 'darwin':
+    compile_args.append('-fopenmp')
+    link_args.append('-fopenmp')
+
+
+class build_ext_openmp(build_ext):
+    """Drops -fopenmp, leaving a serial build, if the compiler cannot build
+    and link a small OpenMP program with it."""
+
+    def build_extensions(self):
+        if any('-fopenmp' in ext.extra_compile_args for ext in self.extensions) and \
+                not self._has_openmp():
+            print("warning: the compiler does not support -fopenmp; building without OpenMP.")
+            for ext in self.extensions:
+                ext.extra_compile_args = [a for a in ext.extra_compile_args if a != '-fopenmp']
+                ext.extra_link_args = [a for a in ext.extra_link_args if a != '-fopenmp']
+        build_ext.build_extensions(self)
+
+    def _has_openmp(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            source = os.path.join(tmp, 'openmp_probe.c')
+            with open(source, 'w') as f:
+                f.write('#include <omp.h>\nint main(void) { return omp_get_max_threads() < 1; }\n')
+            objects = self.compiler.compile([source], output_dir=tmp,
+                extra_postargs=['-fopenmp'])
+            self.compiler.link_executable(objects, 'openmp_probe', output_dir=tmp,
+                extra_postargs=['-fopenmp'])
+            return True
+        except (CompileError, LinkError):
+            return False
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
 extensions = [
     Extension("pyvoro.voroplusplus", ["pyvoro/voroplusplus.pyx", "pyvoro/vpp.cpp"] + source_files,
-        include_dirs = ["pyvoro", "src"])
+        include_dirs = ["pyvoro", "src"],
+        language = "c++",
+        extra_compile_args = compile_args,
+        extra_link_args = link_args)
 ]
 
 setup(
@@ -32,7 +104,16 @@ setup(
     download_url="https://github.com/joe-jordan/pyvoro/tarball/v1.3.2",
     packages=["pyvoro",],
     package_dir={"pyvoro": "pyvoro"},
-    ext_modules=cythonize(extensions),
+    install_requires=["numpy"],
+    cmdclass={'build_ext': build_ext_openmp},
+    # the .pyx validates its inputs itself, so the generated C can skip Cython's
+    # own bounds, wraparound, None and zero-division checks.
+    ext_modules=cythonize(extensions, nthreads=os.cpu_count() or 1,
+        language_level=3,
+        compiler_directives={
+            'boundscheck': False, 'wraparound': False,
+            'cdivision': True, 'initializedcheck': False,
+            'nonecheck': False, 'infer_types': True}),
     keywords=["geometry", "mathematics", "Voronoi"],
     classifiers=[],
 )
@@ -0,0 +1,149 @@
+#
+# test_consistency.py : checks that pyvoro's alternative outputs and entry
+# points agree with the default list of cells from compute_voronoi.
+#
+# run with `python -m pytest tests` or `python tests/test_consistency.py`, after
+# `python setup.py build_ext --inplace`.
+#
+
+import pickle
+
+import numpy as np
+
+import pyvoro
+from pyvoro import voroplusplus
+
+LIMITS = [[0., 6.], [0., 4.], [0., 3.]]
+DISPERSION = 1.0
+CASES = [
+  # (periodic, radical)
+  ([False] * 3, False),
+  ([False] * 3, True),
+  ([True, False, False], False),
+  ([True] * 3, True),
+]
+
+
+def _points(n=800, seed=0):
+  rs = np.random.RandomState(seed)
+  points = rs.uniform(0., 1., (n, 3)) * [l[1] for l in LIMITS]
+  radii = rs.uniform(0.01, 0.05, n)
+  return points, radii
+
+
+def _cells(points, radii, periodic, radical, **kwargs):
+  return pyvoro.compute_voronoi(points.tolist(), LIMITS, DISPERSION,
+    radii=radii.tolist() if radical else [], periodic=periodic, **kwargs)
+
+
+def _geometry(cell):
+  # a cell's faces and edges by vertex position, independent of vertex order.
+  positions = [tuple(np.round(v, 8)) for v in cell['vertices']]
+  faces = sorted((f['adjacent_cell'], frozenset(positions[i] for i in f['vertices']))
+    for f in cell['faces'])
+  edges = frozenset(frozenset((positions[i], positions[j]))
+    for i, adjacent in enumerate(cell['adjacency']) for j in adjacent)
+  return round(cell['volume'], 9), faces, edges
+
+
+def test_arrays_match_cells():
+  points, radii = _points()
+  for periodic, radical in CASES:
+    cells = _cells(points, radii, periodic, radical)
+    arrays = _cells(points, radii, periodic, radical, output='arrays')
+    vo, ao = arrays['vert_offsets'], arrays['adj_offsets']
+    fo, cfo = arrays['face_offsets'], arrays['cell_face_offsets']
+    assert len(arrays['volumes']) == len(cells)
+    for i, cell in enumerate(cells):
+      base = vo[i]
+      assert arrays['volumes'][i] == cell['volume']
+      assert np.array_equal(arrays['vertices'][vo[i]:vo[i + 1]], cell['vertices'])
+      assert [(arrays['adjacency'][ao[v]:ao[v + 1]] - base).tolist()
+        for v in range(vo[i], vo[i + 1])] == cell['adjacency']
+      assert [(arrays['face_vid'][fo[f]:fo[f + 1]] - base).tolist()
+        for f in range(cfo[i], cfo[i + 1])] == [f['vertices'] for f in cell['faces']]
+      assert arrays['face_adj_cell'][cfo[i]:cfo[i + 1]].tolist() == \
+        [f['adjacent_cell'] for f in cell['faces']]
+
+
+def test_neighbors_only_match_cells():
+  points, radii = _points()
+  for periodic, radical in CASES:
+    cells = _cells(points, radii, periodic, radical)
+    neighbours = _cells(points, radii, periodic, radical, neighbors_only=True)
+    arrays = _cells(points, radii, periodic, radical, neighbors_only=True, output='arrays')
+    expected = [[f['adjacent_cell'] for f in cell['faces']] for cell in cells]
+    assert neighbours == expected
+    offsets = arrays['neighbor_offsets']
+    assert [arrays['neighbors'][offsets[i]:offsets[i + 1]].tolist()
+      for i in range(len(cells))] == expected
+
+
+def test_namedtuples_and_lazy_vertices_match_cells():
+  points, radii = _points()
+  for periodic, radical in CASES:
+    cells = _cells(points, radii, periodic, radical)
+    tuples = _cells(points, radii, periodic, radical, return_type='namedtuple')
+    lazy = _cells(points, radii, periodic, radical, lazy_vertices=True)
+    for cell, t, l in zip(cells, tuples, lazy):
+      assert t.volume == cell['volume'] and t.original == cell['original']
+      assert t.vertices == cell['vertices'] and t.adjacency == cell['adjacency']
+      assert [(f.vertices, f.adjacent_cell) for f in t.faces] == \
+        [(f['vertices'], f['adjacent_cell']) for f in cell['faces']]
+      assert l['vertices'] == cell['vertices'] and len(l['vertices']) == len(cell['vertices'])
+      assert np.array_equal(np.asarray(l['vertices']), cell['vertices'])
+      assert pickle.loads(pickle.dumps(l['vertices'])) == cell['vertices']
+      assert dict(l, vertices=cell['vertices']) == cell
+
+
+def test_session_matches_fresh_calls():
+  for periodic, radical in CASES:
+    session = pyvoro.VoronoiSession(LIMITS, DISPERSION, periodic=periodic, n_estimate=800)
+    # frames of different sizes, so the reused container both grows and shrinks.
+    for seed, n in [(1, 800), (2, 1200), (3, 300)]:
+      points, radii = _points(n, seed)
+      r = radii.tolist() if radical else []
+      assert session.compute(points.tolist(), radii=r) == \
+        _cells(points, radii, periodic, radical)
+      fresh = _cells(points, radii, periodic, radical, output='arrays')
+      again = session.compute(points, radii=r, output='arrays')
+      assert all(np.array_equal(again[k], fresh[k]) for k in fresh)
+
+
+def test_parallel_matches_serial():
+  points, radii = _points(2000)
+  # half the points clustered, so the slabs' halos must grow unevenly.
+  points[:1000] = np.random.RandomState(4).normal(2., 0.4, (1000, 3)) % \
+    [l[1] for l in LIMITS]
+  # closer radii, or some clustered points' radical cells would be empty.
+  radii = 0.01 + (radii - 0.01) / 10
+  for periodic, radical in CASES:
+    serial = _cells(points, radii, periodic, radical)
+    parallel = pyvoro.compute_voronoi_parallel(points.tolist(), LIMITS, DISPERSION,
+      radii=radii.tolist() if radical else [], periodic=periodic, n_jobs=3)
+    assert len(parallel) == len(serial)
+    for a, b in zip(serial, parallel):
+      assert a['original'] == b['original']
+      assert _geometry(a) == _geometry(b)
+
+
+def test_validate_rejects_points_outside_limits():
+  points, radii = _points(10)
+  points[3, 1] = LIMITS[1][1]
+  for error in (ValueError, voroplusplus.VoronoiPlusPlusError):
+    try:
+      pyvoro.compute_voronoi(points.tolist(), LIMITS, DISPERSION)
+    except error:
+      pass
+    else:
+      raise AssertionError("expected %s" % error.__name__)
+  # the same point is fine along a periodic axis.
+  assert len(pyvoro.compute_voronoi(points.tolist(), LIMITS, DISPERSION,
+    periodic=[False, True, False])) == 10
+
+
+if __name__ == '__main__':
+  for name, test in sorted(globals().items()):
+    if name.startswith('test_'):
+      test()
+      print(name, 'ok')